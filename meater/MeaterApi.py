@@ -1,134 +1,221 @@
-import json
+import asyncio
+import os
+import time
 from datetime import datetime
+from pathlib import Path
+
+from aiohttp import ClientResponseError
+from yarl import URL
+
+try:
+	import orjson
+
+	_dumps = orjson.dumps
+	_loads = orjson.loads
+except ImportError:
+	import json
+
+	def _dumps(obj):
+		"""Encode obj as JSON bytes, as orjson.dumps does."""
+		return json.dumps(obj).encode()
+
+	_loads = json.loads
+
+# Parsed once here, as aiohttp would otherwise parse URL strings on every request
+_DEVICES_URL = URL('https://public-api.cloud.meater.com/v1/devices')
+_LOGIN_URL = URL('https://public-api.cloud.meater.com/v1/login')
+
+_JSON_HEADERS = {'Content-Type':'application/json'}
 
 class MeaterApi(object):
 	"""Meater api object"""
 	def __init__(self, aiohttp_session):
 		self._jwt = None
+		self._auth_headers = None
 		self._session = aiohttp_session
 	
 	async def get_all_devices(self):
 		"""Get all the device states."""
 		device_states = await self.__get_raw_state_all()
 
-		devices = []
-
-		for device in device_states:
-			devices.append(self.__get_probe_object(device))
-
-		return devices
+		return [MeaterProbe.from_api(device) for device in device_states]
 
 	async def get_device(self, device_id):
+		"""Get the state of a single device."""
 		device_state = await self.__get_raw_state(device_id)
-		return self.__get_probe_object(device_state)
+		return MeaterProbe.from_api(device_state)
 
-	async def __get_raw_state_all(self):
-		"""Get raw device state from the Meater API. We have to have authenticated before now."""
-		if not self._jwt:
-			raise AuthenticationError('You need to authenticate before making requests to the API.')
-
-		headers = {'Authorization': 'Bearer ' + self._jwt}
-
-		async with self._session.get('https://public-api.cloud.meater.com/v1/devices', headers=headers) as device_state_request:
-			if device_state_request.status == 401:
-				raise AuthenticationError('Unable to authenticate with the Meater API')
+	async def get_devices_by_id(self, device_ids, max_concurrent=4):
+		"""Get the states of several devices, making up to max_concurrent requests at once."""
+		semaphore = asyncio.Semaphore(max_concurrent)
 
-			if device_state_request.status == 500:
-				raise ServiceUnavailableError('The service is currently unavailable')
+		async def get_device(device_id):
+			async with semaphore:
+				return await self.get_device(device_id)
 
-			if device_state_request.status == 429:
-				raise TooManyRequestsError('Too many requests have been made to the API')
+		return await asyncio.gather(*(get_device(device_id) for device_id in device_ids))
 
-			if device_state_request.status != 200:
-				raise Exception('Error connecting to Meater')
-
-			device_state_body = await device_state_request.json()
-			if len(device_state_body) == 0:
-				raise Exception('The server did not return a valid response')
+	async def __get_raw_state_all(self):
+		"""Get raw device state from the Meater API. We have to have authenticated before now."""
+		device_state_body = await self.__get_devices_body(_DEVICES_URL, _DEVICES_ERRORS)
 
-			return device_state_body.get('data').get('devices')
+		return device_state_body['data']['devices']
 		
 	async def __get_raw_state(self, device_id):
 		"""Get raw device state from the Meater API. We have to have authenticated before now."""
-		if not self._jwt:
-			raise AuthenticationError('You need to authenticate before making requests to the API.')
-
-		headers = {'Authorization': 'Bearer ' + self._jwt}
-
-		async with self._session.get('https://public-api.cloud.meater.com/v1/devices/' + device_id, headers=headers) as device_state_request:
-			if device_state_request.status == 404:
-				raise UnknownDeviceError('The specified device could not be found, it might not be connected to Meater Cloud')
+		device_state_body = await self.__get_devices_body(_DEVICES_URL / device_id, _DEVICE_ERRORS)
 
-			if device_state_request.status == 401:
-				raise AuthenticationError('Unable to authenticate with the Meater API')
+		return device_state_body['data']
 
-			if device_state_request.status == 500:
-				raise ServiceUnavailableError('The service is currently unavailable')
-
-			if device_state_request.status == 429:
-				raise TooManyRequestsError('Too many requests have been made to the API')
+	async def __get_devices_body(self, url, errors):
+		"""Get and decode a response from one of the devices endpoints."""
+		if not self._jwt:
+			raise AuthenticationError('You need to authenticate before making requests to the API.')
 
-			if device_state_request.status != 200:
-				raise Exception('Error connecting to Meater')
+		try:
+			async with self._session.get(url, headers=self._auth_headers, raise_for_status=True) as device_state_request:
+				device_state_body = await device_state_request.read()
+		except ClientResponseError as error:
+			if error.status == 401:
+				self.__set_jwt(None)
+			raise _status_error(error, errors, 'Error connecting to Meater') from error
 
-			device_state_body = await device_state_request.json()
-			if len(device_state_body) == 0:
-				raise Exception('The server did not return a valid response')
+		device_state_body = _decode_body(device_state_body)
+		if len(device_state_body) == 0:
+			raise Exception('The server did not return a valid response')
 
-			return device_state_body.get('data')
+		return device_state_body
 
 	async def authenticate(self, email, password):
 		"""Authenticate with Meater."""
 		
-		headers = {'Content-Type':'application/json'}
 		body = {'email':email, 'password':password}
 
-		async with self._session.post('https://public-api.cloud.meater.com/v1/login', data = json.dumps(body), headers=headers) as meater_auth_req:
-			if meater_auth_req.status == 401:
-				raise AuthenticationError('The specified credientals were incorrect')
+		try:
+			async with self._session.post(_LOGIN_URL, data = _dumps(body), headers=_JSON_HEADERS, raise_for_status=True) as meater_auth_req:
+				auth_body = await meater_auth_req.read()
+		except ClientResponseError as error:
+			raise _status_error(error, _AUTH_ERRORS, 'Couldn\'t authenticate with the Meater API') from error
+
+		auth_body = _decode_body(auth_body)
+			
+		jwt = auth_body['data'].get('token') # The JWT is valid indefinitely...
 
-			if meater_auth_req.status == 500:
-				raise ServiceUnavailableError('The service is currently unavailable')
+		if not jwt:
+			raise AuthenticationError('Unable to obtain an auth token from the Meater API')
 
-			if meater_auth_req.status == 429:
-				raise TooManyRequestsError('Too many requests have been made to the API')
+		# Set JWT local variable
+		self.__set_jwt(jwt)
 
-			if meater_auth_req.status != 200:
-				raise Exception('Couldn\'t authenticate with the Meater API')
+		return True
 
-			auth_body = await meater_auth_req.json()
-			
-			jwt = auth_body.get('data').get('token') # The JWT is valid indefinitely...
+	def __set_jwt(self, jwt):
+		"""Set the JWT, and the headers that authenticate requests with it."""
+		self._jwt = jwt
+		self._auth_headers = {'Authorization': 'Bearer ' + jwt} if jwt else None
 
-			if not jwt:
-				raise AuthenticationError('Unable to obtain an auth token from the Meater API')
+	def load_cached_jwt(self, path=None):
+		"""Load a previously saved JWT, returns False if there isn't one."""
+		try:
+			cached = _loads(_jwt_cache_path(path).read_bytes())
+		except (OSError, ValueError):
+			return False
 
-			# Set JWT local variable
-			self._jwt = jwt
+		if not isinstance(cached, dict):
+			return False
 
-			return True
+		jwt = cached.get('jwt')
 
-	def __get_probe_object(self, device):
-		cook = None
+		if not isinstance(jwt, str) or not jwt:
+			return False
 
-		if device.get('cook'):
-			target_temp = 0
+		self.__set_jwt(jwt)
 
-			cook = MeaterCook(device.get('cook').get('id'), device.get('cook').get('name'), device.get('cook').get('state'), device.get('cook').get('temperature').get('target'), device.get('cook').get('temperature').get('peak'), device.get('cook').get('time').get('remaining'), device.get('cook').get('time').get('elapsed'))
+		return True
 
-		probe = MeaterProbe(device.get('id'), device.get('temperature').get('internal'), device.get('temperature').get('ambient'), cook, device.get('updated_at'))
+	def save_cached_jwt(self, path=None):
+		"""Save the current JWT so later runs can skip authenticating."""
+		if not self._jwt:
+			raise AuthenticationError('You need to authenticate before the auth token can be saved.')
+
+		path = _jwt_cache_path(path)
+		path.parent.mkdir(parents=True, exist_ok=True)
+
+		data = _dumps({'jwt': self._jwt, 'issued_at': int(time.time())})
 
-		return probe
+		# The JWT is as good as a password, so only the owner may read it
+		with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as cache_file:
+			cache_file.write(data)
+		os.chmod(path, 0o600)
+
+_UNSET = object()
 
 class MeaterProbe(object):
-    def __init__(self, id, internal_temp, ambient_temp, cook, time_updated):
+    # Values are kept as returned by the API and only converted when first read.
+    # The cook's structure is checked up front, so a malformed cook fails in from_api.
+    __slots__ = ('id', '_internal', '_ambient', '_cookdata', '_ts', '_internal_temperature', '_ambient_temperature', '_cook', '_time_updated')
+
+    def __init__(self, id, internal_temp, ambient_temp, cook, time_updated, *, cookdata=None):
+        """cook is a MeaterCook or None, or pass the cook from the API as cookdata to build it when first read."""
         self.id = id
-        self.internal_temperature = float(internal_temp) # Always in degrees celcius
-        self.ambient_temperature = float(ambient_temp) # Always in degrees celcius
-        self.cook = cook
-        self.time_updated = datetime.fromtimestamp(time_updated)
+        self._internal = internal_temp
+        self._ambient = ambient_temp
+        self._cookdata = MeaterCook._args_from_api(cookdata) if cookdata else None
+        self._ts = time_updated
+        self._internal_temperature = _UNSET
+        self._ambient_temperature = _UNSET
+        self._cook = _UNSET if cookdata else cook
+        self._time_updated = _UNSET
+
+    @classmethod
+    def from_api(cls, device):
+        """Create a probe from a device returned by the Meater API."""
+        temperature = device['temperature']
+        return cls(device['id'], temperature['internal'], temperature['ambient'], None, device['updated_at'], cookdata=device.get('cook'))
+
+    @property
+    def internal_temperature(self):
+        if self._internal_temperature is _UNSET:
+            self._internal_temperature = float(self._internal) # Always in degrees celcius
+        return self._internal_temperature
+
+    @internal_temperature.setter
+    def internal_temperature(self, value):
+        self._internal_temperature = value
+
+    @property
+    def ambient_temperature(self):
+        if self._ambient_temperature is _UNSET:
+            self._ambient_temperature = float(self._ambient) # Always in degrees celcius
+        return self._ambient_temperature
+
+    @ambient_temperature.setter
+    def ambient_temperature(self, value):
+        self._ambient_temperature = value
+
+    @property
+    def cook(self):
+        if self._cook is _UNSET:
+            self._cook = MeaterCook(*self._cookdata)
+        return self._cook
+
+    @cook.setter
+    def cook(self, value):
+        self._cook = value
+
+    @property
+    def time_updated(self):
+        if self._time_updated is _UNSET:
+            self._time_updated = datetime.fromtimestamp(self._ts)
+        return self._time_updated
+
+    @time_updated.setter
+    def time_updated(self, value):
+        self._time_updated = value
 
 class MeaterCook(object):
+    __slots__ = ('id', 'name', 'state', 'target_temperature', 'peak_temperature', 'time_remaining', 'time_elapsed')
+
     def __init__(self, id, name, state, target_temp, peak_temp, time_remaining, time_elapsed):
         self.id = id
         self.name = name
@@ -142,6 +229,18 @@ class MeaterCook(object):
         if time_elapsed:
             self.time_elapsed = int(time_elapsed) # Always in seconds
 
+    @classmethod
+    def from_api(cls, cook):
+        """Create a cook from the cook of a device returned by the Meater API."""
+        return cls(*cls._args_from_api(cook))
+
+    @staticmethod
+    def _args_from_api(cook):
+        """Get the constructor arguments from a cook returned by the Meater API, without converting them."""
+        temperature = cook['temperature']
+        cook_time = cook['time']
+        return (cook['id'], cook['name'], cook['state'], temperature.get('target'), temperature.get('peak'), cook_time.get('remaining'), cook_time.get('elapsed'))
+
 class UnknownDeviceError(Exception):
 	pass
 
@@ -153,3 +252,41 @@ class ServiceUnavailableError(Exception):
 
 class TooManyRequestsError(Exception):
 	pass
+
+# Map of HTTP status codes to the exception raised, and its message
+_DEVICES_ERRORS = {
+	401: (AuthenticationError, 'Unable to authenticate with the Meater API'),
+	500: (ServiceUnavailableError, 'The service is currently unavailable'),
+	429: (TooManyRequestsError, 'Too many requests have been made to the API'),
+}
+
+_DEVICE_ERRORS = {
+	404: (UnknownDeviceError, 'The specified device could not be found, it might not be connected to Meater Cloud'),
+	401: (AuthenticationError, 'Unable to authenticate with the Meater API'),
+	500: (ServiceUnavailableError, 'The service is currently unavailable'),
+	429: (TooManyRequestsError, 'Too many requests have been made to the API'),
+}
+
+_AUTH_ERRORS = {
+	401: (AuthenticationError, 'The specified credientals were incorrect'),
+	500: (ServiceUnavailableError, 'The service is currently unavailable'),
+	429: (TooManyRequestsError, 'Too many requests have been made to the API'),
+}
+
+def _jwt_cache_path(path):
+	"""Get the JWT cache path, defaulting to ~/.cache/meater/token.json."""
+	if path is None:
+		return Path.home() / '.cache' / 'meater' / 'token.json'
+	return Path(path)
+
+def _decode_body(body):
+	"""Decode a JSON response body, which may be empty if the server didn't return a valid response."""
+	try:
+		return _loads(body)
+	except ValueError as error:
+		raise Exception('The server did not return a valid response') from error
+
+def _status_error(response_error, errors, message):
+	"""Get the exception mapped to an unsuccessful response's status, or a generic one with message."""
+	error, error_message = errors.get(response_error.status, (Exception, message))
+	return error(error_message)
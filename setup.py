@@ -12,7 +12,8 @@ setuptools.setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     url="https://github.com/Sotolotl/meater-python",
-    install_requires=["aiohttp<=4"],
+    install_requires=["aiohttp>=3.4,<=4", "yarl"],
+    extras_require={"speedups": ["orjson"]},
     packages=setuptools.find_packages(),
     classifiers=[
         "Programming Language :: Python :: 3",